@@ -6,6 +6,7 @@ Following the application factory pattern for better modularity
 import os
 from flask import Flask
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 def create_app(config_name=None):
     """Create and configure Flask app"""
@@ -19,6 +20,10 @@ def create_app(config_name=None):
     app.config['DEBUG'] = config.DEBUG
     app.config['SECRET_KEY'] = config.SECRET_KEY
     
+    # Take the client address from the trusted proxies' X-Forwarded-For
+    if config.TRUSTED_PROXIES:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config.TRUSTED_PROXIES)
+    
     # Ensure upload and temp directories exist
     os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
     os.makedirs(config.TEMP_FOLDER, exist_ok=True)
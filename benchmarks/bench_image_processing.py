@@ -0,0 +1,497 @@
+"""
+Microbenchmarks for EWOK image processing
+Times every function in utils/image_processing.py and the /api/process path
+across the wallpaper presets, records peak memory and compares the results
+against a stored JSON baseline. The row-local stages are also run in strips
+on a shared canvas ("strips/..." cases), after checking that their output is
+byte-identical to serial rendering.
+
+Usage:
+    python benchmarks/bench_image_processing.py --save-baseline
+    python benchmarks/bench_image_processing.py --presets "Custom Square" -k gradient
+    python benchmarks/bench_image_processing.py --verify
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import PIL
+from PIL import Image, ImageDraw
+
+from config import WALLPAPER_PRESETS, PARALLEL_WORKERS
+from utils import parallel
+from utils.image_processing import (
+    resize_for_wallpaper, optimize_wallpaper_size,
+    add_text_overlays, add_image_overlays,
+    add_background, add_watermark,
+    adjust_opacity, adjust_saturation
+)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Source photo used for the resize benchmarks (larger than most presets)
+SOURCE_SIZE = (4000, 3000)
+OVERLAY_SIZE = (256, 256)
+OVERLAY_FILENAME = 'bench_overlay.png'
+
+GRADIENT_DIRECTIONS = ['vertical', 'horizontal', 'diagonal']
+PATTERNS = ['dots', 'stripes', 'checker', 'starburst', 'sunburst']
+TEXT_EFFECTS = ['none', 'shadow', 'outline', 'glow']
+EFFECT_STRENGTHS = [1, 3, 5]
+FIT_MODES = ['fit', 'crop', 'stretch']
+
+WATERMARK = {'type': 'text', 'text': 'EWOK', 'position': 'bottom-right',
+             'size': 36, 'color': '#FFFFFF', 'opacity': 50}
+GRADIENT = {'type': 'gradient', 'start_color': '#FF8800', 'end_color': '#003366',
+            'direction': 'diagonal'}
+
+
+def row_pipeline(img):
+    """The row-local stages of a typical /api/process request, back to back"""
+    img = adjust_opacity(img, 0.6)
+    img = adjust_saturation(img, 1.4)
+    img = add_background(img, GRADIENT)
+    return add_watermark(img, WATERMARK)
+
+
+# Row-local stages that utils.parallel can render in strips
+ROW_STAGES = {
+    'adjust_opacity': lambda img: adjust_opacity(img, 0.6),
+    'adjust_saturation': lambda img: adjust_saturation(img, 1.4),
+    'add_background/color': lambda img: add_background(img, {'type': 'color', 'color': '#336699'}),
+    'add_background/gradient-diagonal': lambda img: add_background(img, GRADIENT),
+    'add_background/pattern-dots': lambda img: add_background(
+        img, {'type': 'pattern', 'pattern': 'dots', 'color1': '#FFFFFF', 'color2': '#E0E0E0'}),
+    'add_watermark': lambda img: add_watermark(img, WATERMARK),
+    'row_pipeline': row_pipeline,
+}
+
+
+class Case:
+    """A single benchmark: `setup` builds fresh inputs, `run` is the timed call"""
+
+    def __init__(self, name, preset, setup, run, reference=None):
+        self.name = name
+        self.preset = preset
+        self.setup = setup
+        self.run = run
+        # Serial equivalent whose output `run` must match exactly
+        self.reference = reference
+
+    @property
+    def key(self):
+        return f"{self.name}[{self.preset}]"
+
+
+def synthetic_image(size, mode='RGBA'):
+    """Build a deterministic test image with gradients, shapes and transparency"""
+    width, height = size
+    red = Image.linear_gradient('L').resize(size)
+    green = Image.linear_gradient('L').rotate(90).resize(size)
+    blue = Image.radial_gradient('L').resize(size)
+    alpha = Image.new('L', size, 255)
+    img = Image.merge('RGBA', (red, green, blue, alpha))
+
+    draw = ImageDraw.Draw(img)
+    step = max(1, min(width, height) // 8)
+    for i in range(0, max(width, height), step):
+        draw.ellipse([i, i // 2, i + step, i // 2 + step], fill=(255, 255, 255, 0))
+        draw.line([0, i, width, height - i], fill=(20, 40, 60, 255), width=3)
+
+    return img if mode == 'RGBA' else img.convert(mode)
+
+
+def on_shared_canvas(func):
+    """Wrap a stage to run on a SharedCanvas the way /api/process does,
+    including the copy into shared memory and back out"""
+    def run(img):
+        canvas = parallel.share(img)
+        if canvas is None:
+            raise RuntimeError("No shared memory available for strip rendering")
+        try:
+            result = canvas.export(func(canvas.image))
+        finally:
+            canvas.close()
+        return result
+    return run
+
+
+def preset_sizes(names=None):
+    """Return the fixed-size wallpaper presets, optionally filtered by name"""
+    presets = {
+        name: size for name, size in WALLPAPER_PRESETS.items()
+        if isinstance(size, tuple)
+    }
+    if names:
+        unknown = [name for name in names if name not in presets]
+        if unknown:
+            raise SystemExit(f"Unknown preset(s): {', '.join(unknown)}")
+        presets = {name: presets[name] for name in names}
+    return presets
+
+
+def build_cases(presets, upload_folder, app_client=None):
+    """Build the benchmark cases for every function and preset"""
+    cases = []
+    source = synthetic_image(SOURCE_SIZE)
+
+    for preset, size in presets.items():
+        canvas = synthetic_image(size)
+
+        def fresh_canvas(canvas=canvas):
+            return (canvas.copy(),)
+
+        for name in ('adjust_opacity', 'adjust_saturation'):
+            cases.append(Case(name, preset, fresh_canvas, ROW_STAGES[name]))
+
+        cases.append(Case('add_background/color', preset, fresh_canvas,
+                          lambda img: add_background(img, {'type': 'color', 'color': '#336699'})))
+
+        for direction in GRADIENT_DIRECTIONS:
+            config = {'type': 'gradient', 'start_color': '#FF8800',
+                      'end_color': '#003366', 'direction': direction}
+            cases.append(Case(f'add_background/gradient-{direction}', preset, fresh_canvas,
+                              lambda img, config=config: add_background(img, config)))
+
+        for pattern in PATTERNS:
+            config = {'type': 'pattern', 'pattern': pattern,
+                      'color1': '#FFFFFF', 'color2': '#E0E0E0'}
+            cases.append(Case(f'add_background/pattern-{pattern}', preset, fresh_canvas,
+                              lambda img, config=config: add_background(img, config)))
+
+        for effect in TEXT_EFFECTS:
+            strengths = EFFECT_STRENGTHS if effect != 'none' else [0]
+            for strength in strengths:
+                overlays = [{
+                    'text': 'EWOK benchmark',
+                    'x': '50%', 'y': '50%',
+                    'size': 48,
+                    'color': '#FFFFFF',
+                    'text_effect': effect,
+                    'effect_color': '#000000',
+                    'effect_strength': strength,
+                }]
+                name = f'add_text_overlays/{effect}' + (f'-{strength}' if effect != 'none' else '')
+                cases.append(Case(name, preset, fresh_canvas,
+                                  lambda img, overlays=overlays: add_text_overlays(img, overlays)))
+
+        cases.append(Case('add_watermark', preset, fresh_canvas, ROW_STAGES['add_watermark']))
+
+        image_overlays = [
+            {'filename': OVERLAY_FILENAME, 'x': 20, 'y': 20},
+            {'filename': OVERLAY_FILENAME, 'x': '50%', 'y': '50%',
+             'width': 512, 'height': 512, 'opacity': 60},
+        ]
+        cases.append(Case('add_image_overlays', preset, fresh_canvas,
+                          lambda img, image_overlays=image_overlays:
+                              add_image_overlays(img, image_overlays, upload_folder)))
+
+        for fit_mode in FIT_MODES:
+            cases.append(Case(f'resize_for_wallpaper/{fit_mode}', preset,
+                              lambda: (source.copy(),),
+                              lambda img, size=size, fit_mode=fit_mode:
+                                  resize_for_wallpaper(img, size, fit_mode)))
+
+        cases.append(Case('optimize_wallpaper_size', preset, fresh_canvas, optimize_wallpaper_size))
+
+        cases.append(Case('row_pipeline', preset, fresh_canvas, row_pipeline))
+        for name, func in ROW_STAGES.items():
+            cases.append(Case(f'strips/{name}', preset, fresh_canvas,
+                              on_shared_canvas(func), reference=func))
+
+        if app_client is not None:
+            cases.append(Case('api/process', preset, lambda: (),
+                              lambda preset=preset: _post_process(app_client, preset)))
+
+    return cases
+
+
+def _post_process(client, preset):
+    """Run the full /api/process pipeline for one preset"""
+    payload = {
+        'filename': client.bench_filename,
+        'opacity': 90,
+        'saturation': 120,
+        'wallpaper_mode': True,
+        'wallpaper_preset': preset,
+        'fit_mode': 'crop',
+        'text_overlays': [{'text': 'EWOK benchmark', 'x': '50%', 'y': '30%', 'size': 48,
+                           'text_effect': 'shadow', 'effect_strength': 3}],
+        'image_overlays': [{'filename': OVERLAY_FILENAME, 'x': 20, 'y': 20, 'opacity': 80}],
+        'background': {'type': 'color', 'color': '#202020'},
+        'watermark': {'type': 'text', 'text': 'EWOK', 'position': 'bottom-right', 'opacity': 50},
+    }
+    response = client.post('/api/process', json=payload)
+    if response.status_code != 200:
+        raise RuntimeError(f"/api/process failed: {response.get_json()}")
+    return response
+
+
+def make_app_client():
+    """Create a Flask test client and upload the synthetic source image"""
+    from app_factory import create_app
+
+    app = create_app()
+    app.config['TESTING'] = True
+    client = app.test_client()
+
+    buffer = io.BytesIO()
+    synthetic_image(SOURCE_SIZE).save(buffer, 'PNG')
+    buffer.seek(0)
+    response = client.post('/api/upload', data={'file': (buffer, 'bench_source.png')},
+                           content_type='multipart/form-data')
+    if response.status_code != 200:
+        raise RuntimeError(f"/api/upload failed: {response.get_json()}")
+    client.bench_filename = response.get_json()['filename']
+    return client
+
+
+def verify_case(case):
+    """Check a case's output is byte-identical to its serial reference"""
+    expected = case.reference(*case.setup())
+    actual = case.run(*case.setup())
+    return (actual.mode == expected.mode and actual.size == expected.size
+            and actual.tobytes() == expected.tobytes())
+
+
+def time_case(case, repeat):
+    """Time `repeat` runs of a case, returning (min, median) in seconds"""
+    timings = []
+    for _ in range(repeat):
+        args = case.setup()
+        start = time.perf_counter()
+        case.run(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), statistics.median(timings)
+
+
+def _maxrss_bytes():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def _measure_memory(case, conn=None):
+    """Run a case once under tracemalloc and report peak memory usage
+
+    Pillow allocates pixel buffers outside the Python allocator, so tracemalloc
+    only sees Python-side allocations. The peak RSS growth is measured as well
+    when running in a forked child, which starts with a fresh high-water mark.
+    """
+    args = case.setup()
+    rss_before = _maxrss_bytes() if conn is not None else None
+
+    tracemalloc.start()
+    try:
+        case.run(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        'peak_traced_bytes': peak,
+        'peak_rss_bytes': _maxrss_bytes() - rss_before if rss_before is not None else None,
+    }
+    if conn is None:
+        return result
+    # The child joins its processes on exit after its queues are closed, so
+    # a pool started by a strip case has to be fully stopped first
+    parallel.shutdown(wait=True)
+    conn.send(result)
+    conn.close()
+
+
+def memory_case(case):
+    """Measure peak memory, in a forked child process where supported"""
+    if resource is None or 'fork' not in multiprocessing.get_all_start_methods():
+        return _measure_memory(case)
+
+    ctx = multiprocessing.get_context('fork')
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_measure_memory, args=(case, child_conn))
+    process.start()
+    child_conn.close()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        raise RuntimeError(f"Memory measurement crashed for {case.key}")
+    finally:
+        process.join()
+    return result
+
+
+def compare(results, baseline, time_threshold, memory_threshold):
+    """Return a list of human readable regressions against the baseline"""
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+
+        if previous.get('min_s') and current['min_s'] > previous['min_s'] * (1 + time_threshold):
+            change = current['min_s'] / previous['min_s'] - 1
+            regressions.append(f"{key}: time {previous['min_s']:.4f}s -> "
+                               f"{current['min_s']:.4f}s (+{change:.0%})")
+
+        for metric in ('peak_traced_bytes', 'peak_rss_bytes'):
+            old, new = previous.get(metric), current.get(metric)
+            # Ignore tiny absolute values where noise dominates
+            if not old or new is None or max(old, new) < 1024 * 1024:
+                continue
+            if new > old * (1 + memory_threshold):
+                regressions.append(f"{key}: {metric} {old / 1e6:.1f}MB -> "
+                                   f"{new / 1e6:.1f}MB (+{new / old - 1:.0%})")
+    return regressions
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get('results', {})
+
+
+def save_results(path, results):
+    data = {
+        'meta': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark EWOK image processing functions')
+    parser.add_argument('--presets', help='Comma separated preset names (default: all fixed-size presets)')
+    parser.add_argument('-k', dest='keyword', help='Only run cases whose key contains this substring')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case (default: 3)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Merge these results into the baseline file instead of comparing')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed relative time regression (default: 0.25)')
+    parser.add_argument('--memory-threshold', type=float, default=0.25,
+                        help='Allowed relative peak memory regression (default: 0.25)')
+    parser.add_argument('--no-memory', action='store_true', help='Skip peak memory measurement')
+    parser.add_argument('--no-api', action='store_true', help='Skip the /api/process cases')
+    parser.add_argument('--strip-workers', type=int, default=max(2, PARALLEL_WORKERS),
+                        help='Pool size for strip rendering (default: PARALLEL_WORKERS, at least 2)')
+    parser.add_argument('--verify', action='store_true',
+                        help='Only check strip rendering matches serial rendering, without timing')
+    parser.add_argument('--list', action='store_true', help='List the case keys and exit')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline_path = os.path.abspath(args.baseline)
+    output_path = os.path.abspath(args.output) if args.output else None
+    presets = preset_sizes(args.presets.split(',') if args.presets else None)
+
+    with tempfile.TemporaryDirectory(prefix='ewok-bench-') as workdir:
+        # create_app() and the API use relative upload/temp folders
+        previous_cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            client = None if args.no_api or args.list or args.verify else make_app_client()
+            parallel.configure(workers=args.strip_workers)
+            upload_folder = os.path.join(workdir, 'static', 'uploads')
+            os.makedirs(upload_folder, exist_ok=True)
+            synthetic_image(OVERLAY_SIZE).save(os.path.join(upload_folder, OVERLAY_FILENAME))
+
+            cases = build_cases(presets, upload_folder, client)
+            if args.keyword:
+                cases = [case for case in cases if args.keyword in case.key]
+
+            if args.list:
+                for case in cases:
+                    print(case.key)
+                return 0
+
+            if args.verify:
+                cases = [case for case in cases if case.reference is not None]
+            results = {}
+            mismatches = []
+            for case in cases:
+                if case.reference is not None:
+                    if not verify_case(case):
+                        mismatches.append(case.key)
+                        print(f"{case.key:<60} MISMATCH against serial rendering", flush=True)
+                        continue
+                    if args.verify:
+                        print(f"{case.key:<60} ok", flush=True)
+                        continue
+
+                best, median = time_case(case, args.repeat)
+                result = {'min_s': best, 'median_s': median, 'repeat': args.repeat}
+                if not args.no_memory:
+                    result.update(memory_case(case))
+                results[case.key] = result
+
+                memory = ''
+                if result.get('peak_rss_bytes') is not None:
+                    memory = f"  rss +{result['peak_rss_bytes'] / 1e6:8.1f}MB"
+                if 'peak_traced_bytes' in result:
+                    memory += f"  traced {result['peak_traced_bytes'] / 1e6:8.1f}MB"
+                print(f"{case.key:<60} {best:9.4f}s (median {median:.4f}s){memory}", flush=True)
+        finally:
+            os.chdir(previous_cwd)
+            parallel.shutdown()
+
+    if mismatches:
+        print(f"\n{len(mismatches)} strip rendering mismatch(es) against serial rendering")
+        return 1
+    if args.verify:
+        print(f"\nStrip rendering matches serial rendering for {len(cases)} case(s)")
+        return 0
+
+    if output_path:
+        save_results(output_path, results)
+
+    if args.save_baseline:
+        merged = load_baseline(baseline_path)
+        merged.update(results)
+        save_results(baseline_path, merged)
+        print(f"Saved {len(results)} result(s) to {baseline_path}")
+        return 0
+
+    baseline = load_baseline(baseline_path)
+    if not baseline:
+        print(f"No baseline at {baseline_path}; run with --save-baseline to create one")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold, args.memory_threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) against {baseline_path}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+
+    print(f"\nNo regressions against {baseline_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,646 @@
+"""
+End-to-end load test for EWOK
+Runs the app under gunicorn with N workers, drives a weighted mix of
+/api/process payloads from M concurrent clients (each followed by a preview
+fetch) and reports latency percentiles, error rates, throughput, worker
+CPU/RSS over time and disk growth in TEMP_FOLDER
+
+Requires gunicorn (pip install gunicorn). psutil is used for process metrics
+when installed, otherwise they are read from /proc on Linux.
+
+Usage:
+    python benchmarks/loadtest.py --workers 4 --concurrency 1,4,8,16 --duration 30
+    python benchmarks/loadtest.py --mix watermark=5,wallpaper-desktop=1 --output report.json
+"""
+
+import argparse
+import http.client
+import io
+import json
+import math
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import UPLOAD_FOLDER, TEMP_FOLDER
+from bench_image_processing import synthetic_image
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Source images uploaded once before the run, keyed by name
+SOURCES = {
+    'photo': (1600, 1200),
+    'large-photo': (4000, 3000),
+    'logo': (256, 256),
+}
+
+# Realistic /api/process payloads; 'source' names one of SOURCES
+SCENARIOS = {
+    'watermark': {
+        'source': 'photo',
+        'watermark': {'type': 'text', 'text': 'EWOK', 'position': 'bottom-right', 'opacity': 50},
+    },
+    'adjust': {
+        'source': 'photo',
+        'opacity': 85,
+        'saturation': 130,
+        'resize': 75,
+    },
+    'text-effects': {
+        'source': 'photo',
+        'text_overlays': [
+            {'text': 'Forest', 'x': '50%', 'y': '20%', 'size': 64,
+             'text_effect': 'outline', 'effect_strength': 3},
+            {'text': 'Endor', 'x': '50%', 'y': '80%', 'size': 48,
+             'text_effect': 'glow', 'effect_color': '#00FF00', 'effect_strength': 3},
+        ],
+    },
+    'wallpaper-phone': {
+        'source': 'photo',
+        'wallpaper_mode': True,
+        'wallpaper_preset': 'iPhone 15 Pro',
+        'fit_mode': 'crop',
+        'background': {'type': 'pattern', 'pattern': 'dots'},
+        'image_overlays': [{'source': 'logo', 'x': 40, 'y': 40, 'opacity': 70}],
+    },
+    'wallpaper-desktop': {
+        'source': 'large-photo',
+        'wallpaper_mode': True,
+        'wallpaper_preset': 'Custom 16:9 4K',
+        'fit_mode': 'fit',
+        'background': {'type': 'color', 'color': '#102030'},
+        'watermark': {'type': 'text', 'text': 'EWOK', 'position': 'center', 'opacity': 30},
+    },
+    'wallpaper-gradient': {
+        'source': 'photo',
+        'wallpaper_mode': True,
+        'wallpaper_preset': 'Custom 16:9 1080p',
+        'fit_mode': 'fit',
+        'background': {'type': 'gradient', 'direction': 'vertical',
+                       'start_color': '#FF8800', 'end_color': '#003366'},
+    },
+}
+
+DEFAULT_MIX = {
+    'watermark': 4,
+    'adjust': 3,
+    'text-effects': 2,
+    'wallpaper-phone': 2,
+    'wallpaper-desktop': 1,
+    'wallpaper-gradient': 1,
+}
+
+# Header each simulated client sends its own user id in, so per-user quotas
+# apply to it as they would to a real user rather than to the whole run
+USER_HEADER = 'X-Loadtest-User'
+
+# Latency histogram bucket upper bounds in seconds
+HISTOGRAM_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Server:
+    """A gunicorn server running the app from the repository root
+
+    The API resolves preview and download paths relative to the app root, so
+    the server has to run there like `python app.py` does. Only the gunicorn
+    log goes to `logdir`.
+    """
+
+    def __init__(self, logdir, workers, threads, timeout):
+        self.logdir = logdir
+        self.workers = workers
+        self.port = free_port()
+        self.command = [
+            sys.executable, '-m', 'gunicorn',
+            '--workers', str(workers),
+            '--threads', str(threads),
+            '--timeout', str(timeout),
+            '--bind', f'127.0.0.1:{self.port}',
+            '--log-level', 'warning',
+            'app:app',
+        ]
+        self.process = None
+        self.log = None
+
+    def start(self, wait=30):
+        self.log = open(os.path.join(self.logdir, 'gunicorn.log'), 'w')
+        # config.py sizes each worker's rendering pool from WEB_CONCURRENCY
+        # and reads the user id header from USER_ID_HEADER. The workers share
+        # an admission budget of their own, apart from any other server's.
+        env = dict(os.environ, WEB_CONCURRENCY=str(self.workers), USER_ID_HEADER=USER_HEADER,
+                   SCHEDULER_STATE_FILE=os.path.join(self.logdir, 'scheduler.json'))
+        self.process = subprocess.Popen(self.command, cwd=REPO_ROOT, env=env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.time() + wait
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited early, see {self.log.name}")
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=1)
+                conn.request('GET', '/')
+                conn.getresponse().read()
+                conn.close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f"gunicorn did not start within {wait}s")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.log:
+            self.log.close()
+
+
+def _proc_descendants(pid):
+    """List the pids of all descendants of a process from /proc"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+
+    descendants = []
+    pending = [pid]
+    while pending:
+        found = children.get(pending.pop(), [])
+        descendants.extend(found)
+        pending.extend(found)
+    return descendants
+
+
+def _proc_usage(pid):
+    """Return (cpu_seconds, rss_bytes) for a pid from /proc"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    ticks = os.sysconf('SC_CLK_TCK')
+    cpu = (int(fields[11]) + int(fields[12])) / ticks
+    with open(f'/proc/{pid}/statm') as f:
+        rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    return cpu, rss
+
+
+def process_usage(master_pid):
+    """Return {pid: (cpu_seconds, rss_bytes)} for gunicorn master and workers
+
+    Includes every descendant, so the strip rendering pools, which run under
+    each worker's fork server, are counted too.
+    """
+    usage = {}
+    if psutil is not None:
+        try:
+            master = psutil.Process(master_pid)
+            for proc in [master] + master.children(recursive=True):
+                times = proc.cpu_times()
+                usage[proc.pid] = (times.user + times.system, proc.memory_info().rss)
+        except psutil.Error:
+            pass
+        return usage
+
+    if not os.path.isdir('/proc'):
+        return usage
+    for pid in [master_pid] + _proc_descendants(master_pid):
+        try:
+            usage[pid] = _proc_usage(pid)
+        except (OSError, IndexError, ValueError):
+            continue
+    return usage
+
+
+def list_files(*folders):
+    """Return the set of file paths currently in the given folders"""
+    paths = set()
+    for folder in folders:
+        for root, _, files in os.walk(folder):
+            paths.update(os.path.join(root, name) for name in files)
+    return paths
+
+
+def folder_usage(path):
+    """Return (file_count, total_bytes) for a directory"""
+    count = total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+                count += 1
+            except OSError:
+                continue
+    return count, total
+
+
+class Sampler(threading.Thread):
+    """Periodically sample server CPU, RSS and TEMP_FOLDER disk usage"""
+
+    def __init__(self, master_pid, temp_folder, interval):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.temp_folder = temp_folder
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+        self.start_time = time.perf_counter()
+
+    def run(self):
+        previous_cpu, previous_time = None, None
+        while not self.stopped.is_set():
+            now = time.perf_counter()
+            usage = process_usage(self.master_pid)
+            cpu = sum(cpu for cpu, _ in usage.values())
+            files, disk = folder_usage(self.temp_folder)
+            sample = {
+                't': round(now - self.start_time, 3),
+                'rss_bytes': sum(rss for _, rss in usage.values()),
+                'worker_rss_bytes': {str(pid): rss for pid, (_, rss) in usage.items()
+                                     if pid != self.master_pid},
+                'cpu_percent': None,
+                'temp_files': files,
+                'temp_bytes': disk,
+            }
+            if previous_cpu is not None and now > previous_time:
+                sample['cpu_percent'] = round(100 * (cpu - previous_cpu) / (now - previous_time), 1)
+            previous_cpu, previous_time = cpu, now
+            self.samples.append(sample)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def _request(port, method, path, body=None, headers=None, timeout=120):
+    """Send one request on a fresh connection (gunicorn sync workers close them)
+
+    Returns (status, body, headers)
+    """
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.read(), response.headers
+    finally:
+        conn.close()
+
+
+def upload_sources(port):
+    """Upload the synthetic source images and return their stored filenames"""
+    filenames = {}
+    for name, size in SOURCES.items():
+        buffer = io.BytesIO()
+        synthetic_image(size).convert('RGB').save(buffer, 'JPEG', quality=90)
+        boundary = uuid.uuid4().hex
+        body = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="file"; filename="{name}.jpg"\r\n'
+            'Content-Type: image/jpeg\r\n\r\n'
+        ).encode() + buffer.getvalue() + f'\r\n--{boundary}--\r\n'.encode()
+        status, data, _ = _request(port, 'POST', '/api/upload', body,
+                                {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        if status != 200:
+            raise RuntimeError(f"Upload of {name} failed: {status} {data[:200]!r}")
+        filenames[name] = json.loads(data)['filename']
+    return filenames
+
+
+def build_payload(scenario, filenames):
+    """Resolve source references in a scenario into an /api/process payload"""
+    payload = json.loads(json.dumps(scenario))
+    payload['filename'] = filenames[payload.pop('source')]
+    for overlay in payload.get('image_overlays', []):
+        overlay['filename'] = filenames[overlay.pop('source')]
+    return payload
+
+
+class Client(threading.Thread):
+    """One simulated user: process an image, then fetch its preview, repeat
+
+    Requests that are not admitted are retried after their Retry-After delay.
+    """
+
+    def __init__(self, port, payloads, weights, deadline, seed, results, timeout, user):
+        super().__init__(daemon=True)
+        self.port = port
+        self.payloads = payloads
+        self.weights = weights
+        self.deadline = deadline
+        self.random = random.Random(seed)
+        self.results = results
+        self.timeout = timeout
+        self.user = user
+
+    def _backoff(self, status, headers):
+        """Sleep for a 429/503 response's Retry-After, until the deadline at most"""
+        if status not in (429, 503):
+            return
+        try:
+            delay = float(headers.get('Retry-After', 0))
+        except ValueError:
+            return
+        time.sleep(max(0.0, min(delay, self.deadline - time.perf_counter())))
+
+    def run(self):
+        names = list(self.payloads)
+        while time.perf_counter() < self.deadline:
+            name = self.random.choices(names, self.weights)[0]
+            body = json.dumps(self.payloads[name])
+            result = {'scenario': name, 'ok': False, 'status': None,
+                      'process_s': None, 'preview_s': None, 'total_s': None}
+            start = time.perf_counter()
+            headers = {}
+            try:
+                status, data, headers = _request(
+                    self.port, 'POST', '/api/process', body,
+                    {'Content-Type': 'application/json', USER_HEADER: self.user}, self.timeout)
+                result['status'] = status
+                result['process_s'] = time.perf_counter() - start
+                if status == 200:
+                    processed = json.loads(data)['processed_filename']
+                    preview_start = time.perf_counter()
+                    status, _, _ = _request(self.port, 'GET', f'/api/preview/{processed}',
+                                            timeout=self.timeout)
+                    result['status'] = status
+                    result['preview_s'] = time.perf_counter() - preview_start
+                    result['ok'] = status == 200
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                result['error'] = f'{type(e).__name__}: {e}'
+            result['total_s'] = time.perf_counter() - start
+            result['finished'] = time.perf_counter()
+            self.results.append(result)
+            self._backoff(result['status'], headers)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_summary(values):
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_s': sum(values) / len(values),
+        'p50_s': percentile(values, 50),
+        'p95_s': percentile(values, 95),
+        'p99_s': percentile(values, 99),
+        'max_s': max(values),
+    }
+
+
+def histogram(values):
+    counts = [0] * len(HISTOGRAM_BUCKETS)
+    for value in values:
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if value <= bound:
+                counts[i] += 1
+                break
+    return [{'le_s': bound if bound != math.inf else None, 'count': count}
+            for bound, count in zip(HISTOGRAM_BUCKETS, counts)]
+
+
+def summarize_level(concurrency, results, elapsed):
+    """Aggregate the client results for one concurrency level"""
+    ok = [r for r in results if r['ok']]
+    totals = [r['total_s'] for r in ok]
+    scenarios = {}
+    for name in sorted({r['scenario'] for r in results}):
+        runs = [r for r in results if r['scenario'] == name]
+        scenarios[name] = {
+            'requests': len(runs),
+            'errors': sum(1 for r in runs if not r['ok']),
+            'total': latency_summary([r['total_s'] for r in runs if r['ok']]),
+        }
+    statuses = {}
+    for r in results:
+        key = r['error'].split(':')[0] if 'error' in r else str(r['status'])
+        statuses[key] = statuses.get(key, 0) + 1
+    return {
+        'concurrency': concurrency,
+        'elapsed_s': elapsed,
+        'requests': len(results),
+        'errors': len(results) - len(ok),
+        'error_rate': (len(results) - len(ok)) / len(results) if results else 0.0,
+        'throughput_rps': len(ok) / elapsed if elapsed else 0.0,
+        'statuses': statuses,
+        'total': latency_summary(totals),
+        'process': latency_summary([r['process_s'] for r in ok]),
+        'preview': latency_summary([r['preview_s'] for r in ok]),
+        'histogram': histogram(totals),
+        'scenarios': scenarios,
+    }
+
+
+def saturation_point(levels, min_gain):
+    """First concurrency after which throughput grows by less than `min_gain`"""
+    for previous, current in zip(levels, levels[1:]):
+        if previous['throughput_rps'] and \
+                current['throughput_rps'] < previous['throughput_rps'] * (1 + min_gain):
+            return previous['concurrency']
+    return None
+
+
+def run_level(port, payloads, weights, concurrency, duration, seed, timeout):
+    results = []
+    start = time.perf_counter()
+    deadline = start + duration
+    clients = [Client(port, payloads, weights, deadline, seed + i, results, timeout,
+                      user=f'client-{i}')
+               for i in range(concurrency)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    return results, time.perf_counter() - start
+
+
+def _fmt_s(value):
+    return '-' if value is None else f'{value * 1000:8.1f}ms'
+
+
+def print_report(report):
+    print(f"\nServer: gunicorn, {report['config']['workers']} worker(s) x "
+          f"{report['config']['threads']} thread(s)")
+    for level in report['levels']:
+        total = level['total']
+        print(f"\n== concurrency {level['concurrency']}: {level['requests']} requests, "
+              f"{level['throughput_rps']:.2f} req/s, error rate {level['error_rate']:.1%}")
+        if level['errors']:
+            print(f"   statuses: {level['statuses']}")
+        for phase in ('total', 'process', 'preview'):
+            summary = level[phase]
+            if summary['count']:
+                print(f"   {phase:<8} p50 {_fmt_s(summary['p50_s'])}  p95 {_fmt_s(summary['p95_s'])}  "
+                      f"p99 {_fmt_s(summary['p99_s'])}  max {_fmt_s(summary['max_s'])}")
+        if total['count']:
+            peak = max(bucket['count'] for bucket in level['histogram'])
+            for bucket in level['histogram']:
+                if not bucket['count']:
+                    continue
+                label = f"<= {bucket['le_s']}s" if bucket['le_s'] is not None else '> 60s'
+                bar = '#' * max(1, round(40 * bucket['count'] / peak))
+                print(f"   {label:>9} {bucket['count']:6d} {bar}")
+        for name, scenario in level['scenarios'].items():
+            p95 = scenario['total'].get('p95_s')
+            print(f"   - {name:<20} {scenario['requests']:5d} req  {scenario['errors']:4d} err  "
+                  f"p95 {_fmt_s(p95)}")
+
+    if report['saturation_concurrency'] is not None:
+        print(f"\nThroughput saturates at concurrency {report['saturation_concurrency']}")
+
+    samples = report['samples']
+    if samples:
+        print("\n   time   cpu%     rss(MB)  temp files  temp(MB)")
+        step = max(1, len(samples) // 20)
+        for sample in samples[::step] + ([samples[-1]] if (len(samples) - 1) % step else []):
+            cpu = '-' if sample['cpu_percent'] is None else f"{sample['cpu_percent']:.0f}"
+            print(f"   {sample['t']:6.1f} {cpu:>6} {sample['rss_bytes'] / 1e6:11.1f} "
+                  f"{sample['temp_files']:11d} {sample['temp_bytes'] / 1e6:9.1f}")
+        growth = report['growth']
+        print(f"\nPeak worker RSS {report['peak_worker_rss_bytes'] / 1e6:.1f}MB, "
+              f"RSS growth {growth['rss_bytes'] / 1e6:+.1f}MB, "
+              f"TEMP_FOLDER growth {growth['temp_files']:+d} files / {growth['temp_bytes'] / 1e6:+.1f}MB")
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        mix[name.strip()] = float(weight) if weight else 1.0
+    return mix
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load test EWOK under a real WSGI server')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='gunicorn worker processes (default: CPU count)')
+    parser.add_argument('--threads', type=int, default=1, help='Threads per worker (default: 1)')
+    parser.add_argument('--concurrency', default='1,2,4,8',
+                        help='Comma separated client counts, run in turn (default: 1,2,4,8)')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds per concurrency level')
+    parser.add_argument('--mix', type=parse_mix, help='Scenario weights, e.g. watermark=4,adjust=1')
+    parser.add_argument('--scenarios', help='JSON file with extra or replacement scenarios')
+    parser.add_argument('--interval', type=float, default=1.0, help='Metrics sample interval (s)')
+    parser.add_argument('--timeout', type=float, default=120, help='Client and worker timeout (s)')
+    parser.add_argument('--saturation-gain', type=float, default=0.1,
+                        help='Minimum throughput gain to count as scaling (default: 0.1)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the scenario mix')
+    parser.add_argument('--output', help='Write the full report as JSON to this file')
+    parser.add_argument('--keep-files', action='store_true',
+                        help='Keep the uploads, processed images and gunicorn log from the run')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    scenarios = dict(SCENARIOS)
+    if args.scenarios:
+        with open(args.scenarios) as f:
+            scenarios.update(json.load(f))
+    mix = args.mix or {name: weight for name, weight in DEFAULT_MIX.items() if name in scenarios}
+    unknown = [name for name in mix if name not in scenarios]
+    if unknown:
+        raise SystemExit(f"Unknown scenario(s): {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    upload_folder = os.path.join(REPO_ROOT, UPLOAD_FOLDER)
+    temp_folder = os.path.join(REPO_ROOT, TEMP_FOLDER)
+    existing_files = list_files(upload_folder, temp_folder)
+    logdir = tempfile.mkdtemp(prefix='ewok-load-')
+    server = Server(logdir, args.workers, args.threads, int(args.timeout))
+    sampler = None
+    try:
+        server.start()
+        filenames = upload_sources(server.port)
+        payloads = {name: build_payload(scenarios[name], filenames) for name in mix}
+        weights = [mix[name] for name in payloads]
+
+        sampler = Sampler(server.process.pid, temp_folder, args.interval)
+        sampler.start()
+        summaries = []
+        for concurrency in levels:
+            results, elapsed = run_level(server.port, payloads, weights, concurrency,
+                                         args.duration, args.seed, args.timeout)
+            summaries.append(summarize_level(concurrency, results, elapsed))
+        sampler.stop()
+    finally:
+        if sampler is not None and sampler.is_alive():
+            sampler.stop()
+        server.stop()
+        created_files = list_files(upload_folder, temp_folder) - existing_files
+        if not args.keep_files:
+            for path in created_files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            shutil.rmtree(logdir, ignore_errors=True)
+
+    samples = sampler.samples
+    report = {
+        'config': {
+            'workers': args.workers,
+            'threads': args.threads,
+            'duration_s': args.duration,
+            'mix': mix,
+            'psutil': psutil is not None,
+        },
+        'levels': summaries,
+        'saturation_concurrency': saturation_point(summaries, args.saturation_gain),
+        'samples': samples,
+        'growth': {
+            'rss_bytes': samples[-1]['rss_bytes'] - samples[0]['rss_bytes'] if samples else 0,
+            'temp_files': samples[-1]['temp_files'] - samples[0]['temp_files'] if samples else 0,
+            'temp_bytes': samples[-1]['temp_bytes'] - samples[0]['temp_bytes'] if samples else 0,
+        },
+        'peak_worker_rss_bytes': max(
+            (rss for sample in samples for rss in sample['worker_rss_bytes'].values()), default=0),
+    }
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.keep_files:
+        print(f"\nKept {len(created_files)} file(s) in {UPLOAD_FOLDER} and {TEMP_FOLDER}, "
+              f"gunicorn log in {logdir}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
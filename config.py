@@ -3,6 +3,7 @@ Configuration settings for EWOK
 """
 
 import os
+import tempfile
 
 # File upload settings
 UPLOAD_FOLDER = 'static/uploads'
@@ -32,6 +33,37 @@ WALLPAPER_PRESETS = {
     'Optimized': 'auto'  # Special case for optimized sizing
 }
 
+# Admission control for /api/process. Budgets and quotas are in predicted
+# CPU seconds and bytes from the cost model. They are shared by every worker
+# process through SCHEDULER_STATE_FILE, so servers sharing the file share the
+# budget; set it to None to apply them per process instead.
+SCHEDULER_ENABLED = True
+SCHEDULER_STATE_FILE = os.environ.get(
+    'SCHEDULER_STATE_FILE', os.path.join(tempfile.gettempdir(), 'ewok-scheduler.json'))
+SCHEDULER_MEMORY_BUDGET = 1024 * 1024 * 1024  # 1GB of predicted peak memory in flight
+SCHEDULER_CPU_BUDGET = 20.0  # Predicted CPU seconds in flight
+SCHEDULER_MAX_WAIT = 30  # Seconds a request may queue before a 503
+USER_MAX_PENDING = 4  # Concurrent requests per user
+USER_CPU_QUOTA = 120.0  # Predicted CPU seconds per user per window
+USER_QUOTA_WINDOW = 60  # Seconds
+COST_MODEL_SMOOTHING = 0.2  # Weight of each new timing in the calibrated stage costs
+
+# Quotas are per user, identified by client address. Behind reverse proxies,
+# set TRUSTED_PROXIES to how many of them append to X-Forwarded-For so the
+# client's own address is used. USER_ID_HEADER names a header a trusted proxy
+# or gateway sets to identify the user (e.g. 'X-User-Id'); it takes precedence
+# and must not be accepted from clients directly.
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+USER_ID_HEADER = os.environ.get('USER_ID_HEADER')
+
+# Multi-core rendering of large images in horizontal strips. Each server
+# worker process gets its own pool of PARALLEL_WORKERS processes, so the
+# cores are split between the WEB_CONCURRENCY workers gunicorn starts.
+PARALLEL_ENABLED = True
+PARALLEL_PIXEL_THRESHOLD = 8_000_000  # Pixels, roughly a 4K canvas
+SERVER_WORKERS = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+PARALLEL_WORKERS = max(1, min(4, (os.cpu_count() or 1) // SERVER_WORKERS))
+
 # Flask app settings
 DEBUG = True
 SECRET_KEY = os.environ.get('SECRET_KEY', 'ewok-development-key-change-if-in-production')
\ No newline at end of file
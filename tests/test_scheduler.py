@@ -0,0 +1,195 @@
+"""
+Tests for the admission scheduler's queueing, budgets and per-user quotas
+"""
+
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.cost_model import CostEstimate
+from utils.scheduler import AdmissionScheduler, Overloaded, QuotaExceeded
+
+
+def estimate(cpu_seconds, memory_bytes=1):
+    return CostEstimate(cpu_seconds, memory_bytes, {}, (0, 0))
+
+
+def hold_budget(state_path, cost, held, done):
+    """Hold part of a shared budget from another process until done is set"""
+    scheduler = AdmissionScheduler(memory_budget=1000, cpu_budget=1.0, user_max_pending=0,
+                                   user_cpu_quota=0, state_path=state_path)
+    ticket = scheduler.acquire('other', estimate(cost))
+    held.set()
+    done.wait(10)
+    scheduler.release(ticket)
+
+
+class Waiter(threading.Thread):
+    """Acquire in the background and record the ticket or error"""
+
+    def __init__(self, scheduler, user, cost):
+        super().__init__(daemon=True)
+        self.scheduler = scheduler
+        self.user = user
+        self.cost = cost
+        self.ticket = None
+        self.error = None
+        self.admitted = threading.Event()
+
+    def run(self):
+        try:
+            self.ticket = self.scheduler.acquire(self.user, self.cost)
+        except Exception as e:
+            self.error = e
+        self.admitted.set()
+
+
+class AdmissionSchedulerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.state_path = os.path.join(self.tmpdir.name, 'scheduler.json')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def scheduler(self, **kwargs):
+        options = dict(memory_budget=1000, cpu_budget=1.0, max_wait=5,
+                       user_max_pending=0, user_cpu_quota=0, state_path=self.state_path)
+        options.update(kwargs)
+        return AdmissionScheduler(**options)
+
+    def wait_queued(self, scheduler, count):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            with scheduler._locked() as state:
+                if sum(not ticket['admitted'] for ticket in state['tickets'].values()) == count:
+                    return
+            time.sleep(0.01)
+        self.fail(f'{count} request(s) never queued')
+
+    def test_cheapest_waiting_request_is_admitted_first(self):
+        scheduler = self.scheduler()
+        running = scheduler.acquire('a', estimate(0.8))
+        expensive = Waiter(scheduler, 'b', estimate(0.9))
+        expensive.start()
+        self.wait_queued(scheduler, 1)
+        cheap = Waiter(scheduler, 'c', estimate(0.3))
+        cheap.start()
+        self.wait_queued(scheduler, 2)
+
+        scheduler.release(running)
+        self.assertTrue(cheap.admitted.wait(5))
+        self.assertFalse(expensive.admitted.is_set())
+
+        scheduler.release(cheap.ticket)
+        self.assertTrue(expensive.admitted.wait(5))
+        self.assertIsNone(expensive.error)
+        scheduler.release(expensive.ticket)
+
+    def test_request_over_cpu_budget_is_admitted_when_idle(self):
+        scheduler = self.scheduler()
+        ticket = scheduler.acquire('a', estimate(50.0))
+        scheduler.release(ticket)
+
+    def test_request_over_memory_budget_is_rejected(self):
+        with self.assertRaises(Overloaded) as raised:
+            self.scheduler().acquire('a', estimate(0.1, memory_bytes=2000))
+        self.assertEqual(raised.exception.status_code, 503)
+
+    def test_queued_request_times_out_and_returns_its_quota(self):
+        scheduler = self.scheduler(max_wait=0.2, user_cpu_quota=1.0)
+        running = scheduler.acquire('a', estimate(0.8))
+        with self.assertRaises(Overloaded) as raised:
+            scheduler.acquire('b', estimate(0.5))
+        self.assertGreaterEqual(raised.exception.retry_after, 1)
+
+        scheduler.release(running)
+        # Had the abandoned request counted, this would exceed b's quota
+        scheduler.release(scheduler.acquire('b', estimate(0.6)))
+
+    def test_pending_limit_per_user(self):
+        scheduler = self.scheduler(user_max_pending=1)
+        ticket = scheduler.acquire('a', estimate(0.1))
+        with self.assertRaises(QuotaExceeded) as raised:
+            scheduler.acquire('a', estimate(0.1))
+        self.assertEqual(raised.exception.status_code, 429)
+        scheduler.release(scheduler.acquire('b', estimate(0.1)))
+        scheduler.release(ticket)
+        scheduler.release(scheduler.acquire('a', estimate(0.1)))
+
+    def test_cpu_quota_reports_when_to_retry(self):
+        scheduler = self.scheduler(user_cpu_quota=1.0, quota_window=30)
+        scheduler.release(scheduler.acquire('a', estimate(0.7)))
+        with self.assertRaises(QuotaExceeded) as raised:
+            scheduler.acquire('a', estimate(0.7))
+        self.assertTrue(29 <= raised.exception.retry_after <= 30)
+        with self.assertRaises(QuotaExceeded):
+            scheduler.acquire('b', estimate(2.0))
+
+    def test_budget_is_shared_through_the_state_file(self):
+        first = self.scheduler()
+        second = self.scheduler(max_wait=0.2)
+        running = first.acquire('a', estimate(0.8))
+        with self.assertRaises(Overloaded):
+            second.acquire('b', estimate(0.5))
+
+        waiter = Waiter(second, 'b', estimate(0.5))
+        waiter.start()
+        self.wait_queued(second, 1)
+        first.release(running)
+        self.assertTrue(waiter.admitted.wait(5))
+        second.release(waiter.ticket)
+
+    def test_budget_is_shared_between_processes(self):
+        context = multiprocessing.get_context('spawn')
+        held, done = context.Event(), context.Event()
+        other = context.Process(target=hold_budget, args=(self.state_path, 0.8, held, done))
+        other.start()
+        try:
+            self.assertTrue(held.wait(30))
+            scheduler = self.scheduler()
+            waiter = Waiter(scheduler, 'a', estimate(0.5))
+            waiter.start()
+            self.wait_queued(scheduler, 1)
+            self.assertFalse(waiter.admitted.wait(0.3))
+
+            done.set()
+            self.assertTrue(waiter.admitted.wait(5))
+            self.assertIsNone(waiter.error)
+            scheduler.release(waiter.ticket)
+        finally:
+            done.set()
+            other.join(10)
+
+    def test_tickets_of_dead_processes_are_dropped(self):
+        child = subprocess.Popen([sys.executable, '-c', 'pass'])
+        child.wait()
+        state = {'sequence': 1, 'usage': {}, 'tickets': {
+            f'{child.pid}-0': {'user': 'gone', 'cpu_seconds': 0.9, 'memory_bytes': 900,
+                               'sequence': 1, 'admitted': True, 'pid': child.pid},
+        }}
+        with open(self.state_path, 'w') as f:
+            json.dump(state, f)
+
+        scheduler = self.scheduler(max_wait=0.2)
+        scheduler.release(scheduler.acquire('a', estimate(0.5, memory_bytes=500)))
+
+    def test_per_process_without_state_file(self):
+        first = self.scheduler(state_path=None)
+        second = self.scheduler(state_path=None, max_wait=0.2)
+        running = first.acquire('a', estimate(0.8))
+        second.release(second.acquire('b', estimate(0.5)))
+        first.release(running)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+"""
+Cost model for EWOK image processing requests
+Predicts CPU time and peak memory of an /api/process request from its parsed
+spec, and calibrates the per-stage coefficients from recorded stage timings
+"""
+
+import threading
+
+from utils import parallel
+from utils.image_processing import optimized_wallpaper_dimensions
+
+# Seconds per work unit for each pipeline stage. Units are megapixels for the
+# pixel stages, text draws scaled by glyph area for 'text' and overlay count
+# for 'image_overlays'. These defaults are rough single-core figures, the
+# row-local ones from the serial benchmark cases, and are replaced by
+# measurements as requests complete. parallel.worth_sharing() weighs the same
+# calibrated figures against the cost of rendering in strips.
+DEFAULT_STAGE_COSTS = {
+    'decode': 0.03,
+    'opacity': 0.0035,
+    'saturation': 0.0135,
+    'resize': 0.03,
+    'wallpaper': 0.03,
+    'text': 0.0005,
+    'image_overlays': 0.01,
+    'background:color': 0.011,
+    'background:pattern': 0.013,
+    'background:gradient-vertical': 0.016,
+    'background:gradient-horizontal': 0.016,
+    'background:gradient-diagonal': 0.016,
+    'watermark': 0.004,
+    'encode': 0.1,
+}
+
+# Fixed per-request overhead (request parsing, file lookups, response)
+BASE_COST = 0.005
+
+# RGBA pixels are held in 4 bytes; the pipeline keeps the decoded base image,
+# its working copy and up to two full-size intermediates (background or
+# watermark layer plus the result) alive at once
+BYTES_PER_PIXEL = 4
+SOURCE_COPIES = 2
+OUTPUT_COPIES = 2
+# A canvas rendered in strips adds its shared memory block, the scratch block
+# for pattern and watermark layers and the copy exported at the end
+STRIP_COPIES = 3
+MEMORY_OVERHEAD = 16 * 1024 * 1024
+
+
+def _number(value, default):
+    """Coerce a spec value to float, falling back to default"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def text_draws(effect, strength):
+    """Number of draw.text calls add_text_overlays makes for one overlay"""
+    strength = max(0, int(_number(strength, 3)))
+    if effect == 'shadow':
+        return 2
+    if effect == 'outline':
+        return (2 * strength + 1) ** 2
+    if effect == 'glow':
+        return strength * 2 * 12 + 1
+    return 1
+
+
+def text_units(text_overlays):
+    """Work units for a list of text overlays: draws scaled by glyph area"""
+    units = 0.0
+    for overlay in text_overlays or []:
+        if not isinstance(overlay, dict) or not overlay.get('text'):
+            continue
+        size = _number(overlay.get('size', 24), 24)
+        draws = text_draws(overlay.get('text_effect', 'none'), overlay.get('effect_strength', 3))
+        units += draws * max(1.0, (size / 48) ** 2)
+    return units
+
+
+def watermark_applies(watermark_config):
+    """Whether add_watermark draws anything for this config"""
+    return (isinstance(watermark_config, dict) and watermark_config.get('type') == 'text'
+            and bool(str(watermark_config.get('text', '')).strip()))
+
+
+def background_stage(background_config):
+    """Stage key for a background config, or None when no background applies"""
+    if not isinstance(background_config, dict) or not background_config:
+        return None
+    bg_type = background_config.get('type', 'color')
+    if bg_type == 'gradient':
+        direction = background_config.get('direction', 'vertical')
+        if direction not in ('horizontal', 'diagonal'):
+            direction = 'vertical'
+        return f'background:gradient-{direction}'
+    if bg_type in ('color', 'pattern'):
+        return f'background:{bg_type}'
+    return None
+
+
+def row_stages(units):
+    """Split a request's strip-renderable stages into those run before and
+    after resizing, and whether it resizes at all"""
+    before = [stage for stage in ('opacity', 'saturation') if stage in units]
+    after = [stage for stage in units if stage.startswith('background:') or stage == 'watermark']
+    return before, after, 'resize' in units or 'wallpaper' in units
+
+
+class CostEstimate:
+    """Predicted cost of a request"""
+
+    def __init__(self, cpu_seconds, memory_bytes, stages, output_size):
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_bytes
+        self.stages = stages
+        self.output_size = output_size
+
+    def __repr__(self):
+        return (f"CostEstimate(cpu_seconds={self.cpu_seconds:.3f}, "
+                f"memory_bytes={self.memory_bytes}, output_size={self.output_size})")
+
+
+class CostModel:
+    """Per-stage linear cost model calibrated with an exponential moving average"""
+
+    def __init__(self, stage_costs=None, smoothing=0.2):
+        self.stage_costs = dict(DEFAULT_STAGE_COSTS)
+        if stage_costs:
+            self.stage_costs.update(stage_costs)
+        self.smoothing = smoothing
+        self.samples = {stage: 0 for stage in self.stage_costs}
+        self._lock = threading.Lock()
+
+    def stage_units(self, data, source_size, presets):
+        """Return ({stage: units}, output_size) for a parsed /api/process spec"""
+        width, height = source_size
+        source_mp = width * height / 1e6
+        units = {'decode': source_mp}
+
+        if 'opacity' in data and data['opacity'] != 100:
+            units['opacity'] = source_mp
+        if 'saturation' in data and data['saturation'] != 100:
+            units['saturation'] = source_mp
+
+        if 'resize' in data and data['resize'] != 100:
+            factor = max(0.0, _number(data['resize'], 100) / 100.0)
+            new_size = (int(width * factor), int(height * factor))
+            units['resize'] = source_mp + new_size[0] * new_size[1] / 1e6
+            width, height = new_size
+
+        if data.get('wallpaper_mode') and data.get('wallpaper_preset') in presets:
+            preset_name = data['wallpaper_preset']
+            if preset_name == 'Optimized':
+                new_size = optimized_wallpaper_dimensions(width, height) if width and height else None
+            else:
+                new_size = presets[preset_name]
+            if new_size:
+                units['wallpaper'] = (width * height + new_size[0] * new_size[1]) / 1e6
+                width, height = new_size
+
+        output_mp = width * height / 1e6
+        if data.get('text_overlays'):
+            units['text'] = text_units(data['text_overlays'])
+        if data.get('image_overlays'):
+            units['image_overlays'] = float(len(data['image_overlays']))
+        stage = background_stage(data.get('background'))
+        if stage:
+            units[stage] = output_mp
+        if watermark_applies(data.get('watermark')):
+            units['watermark'] = output_mp
+        units['encode'] = output_mp
+
+        return units, (width, height)
+
+    def costs(self, stages):
+        """Current seconds per unit of each of the given stages"""
+        with self._lock:
+            return {stage: self.stage_costs.get(stage, 0.0) for stage in stages}
+
+    def strip_pixels(self, units, source_size, output_size):
+        """Pixels of the canvases the request would move into shared memory"""
+        before, after, resizes = row_stages(units)
+        pixels = 0
+        if resizes:
+            if parallel.worth_sharing(source_size, self.costs(before)):
+                pixels += source_size[0] * source_size[1]
+            if parallel.worth_sharing(output_size, self.costs(after)):
+                pixels += output_size[0] * output_size[1]
+        elif parallel.worth_sharing(source_size, self.costs(before + after)):
+            pixels += source_size[0] * source_size[1]
+        return pixels
+
+    def estimate(self, data, source_size, presets):
+        """Predict CPU seconds and peak memory for a request"""
+        units, output_size = self.stage_units(data, source_size, presets)
+        with self._lock:
+            cpu_seconds = BASE_COST + sum(
+                self.stage_costs.get(stage, 0.0) * amount for stage, amount in units.items()
+            )
+
+        source_pixels = source_size[0] * source_size[1]
+        output_pixels = output_size[0] * output_size[1]
+        memory_bytes = int(
+            BYTES_PER_PIXEL * (SOURCE_COPIES * source_pixels + OUTPUT_COPIES * output_pixels
+                               + STRIP_COPIES * self.strip_pixels(units, source_size, output_size))
+            + MEMORY_OVERHEAD
+        )
+        return CostEstimate(cpu_seconds, memory_bytes, units, output_size)
+
+    def observe(self, stage, units, seconds):
+        """Fold a measured stage timing into the stage coefficient"""
+        if units <= 0 or seconds < 0:
+            return
+        with self._lock:
+            measured = seconds / units
+            current = self.stage_costs.get(stage)
+            if current is None or not self.samples.get(stage):
+                # Take the first real measurement as is
+                self.stage_costs[stage] = measured
+            else:
+                self.stage_costs[stage] = (1 - self.smoothing) * current + self.smoothing * measured
+            self.samples[stage] = self.samples.get(stage, 0) + 1
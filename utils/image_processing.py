@@ -7,10 +7,111 @@ import os
 from PIL import Image, ImageDraw, ImageFont, ImageEnhance
 
 
-def optimize_wallpaper_size(img):
-    """Optimize image size for common wallpaper use while maintaining quality"""
-    width, height = img.size
+def hex_to_rgb(hex_color):
+    """Convert a '#RRGGBB' color to an (r, g, b) tuple"""
+    if hex_color.startswith('#'):
+        hex_color = hex_color[1:]
+    return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+
+
+def _shared_canvas(img):
+    """Return the utils.parallel SharedCanvas holding img, or None"""
+    # Imported here as utils.parallel imports the row-local helpers below
+    from utils import parallel
+    return parallel.canvas_of(img)
+
+
+# Row-local helpers. Each output row depends only on the same input row, so
+# utils.parallel can run them on horizontal strips with identical results.
+
+def apply_opacity(img, opacity):
+    """Scale the alpha channel of an RGBA image by opacity (0.0-1.0)"""
+    alpha = img.split()[-1]  # Get current alpha channel
+    alpha = alpha.point(lambda p: int(p * opacity))  # Scale alpha values
+    img.putalpha(alpha)
+    return img
+
+
+def apply_saturation(img, saturation):
+    """Scale color intensity, 1.0 leaves the image unchanged"""
+    enhancer = ImageEnhance.Color(img)
+    return enhancer.enhance(saturation)
+
+
+def _blend_rgb(start_rgb, end_rgb, ratio):
+    r = int(start_rgb[0] * (1 - ratio) + end_rgb[0] * ratio)
+    g = int(start_rgb[1] * (1 - ratio) + end_rgb[1] * ratio)
+    b = int(start_rgb[2] * (1 - ratio) + end_rgb[2] * ratio)
+    return bytes((r, g, b))
+
+
+def render_background(size, background_config, top=0, bottom=None):
+    """Render rows top..bottom of a color or gradient background as an RGB image"""
+    width, height = size
+    bottom = height if bottom is None else bottom
+    rows = bottom - top
+    bg_type = background_config.get('type', 'color')
+    
+    if bg_type == 'color':
+        rgb_color = hex_to_rgb(background_config.get('color', '#FFFFFF'))
+        return Image.new('RGB', (width, rows), rgb_color)
     
+    start_rgb = hex_to_rgb(background_config.get('start_color', '#FFFFFF'))
+    end_rgb = hex_to_rgb(background_config.get('end_color', '#000000'))
+    direction = background_config.get('direction', 'vertical')  # vertical, horizontal, diagonal
+    
+    if direction == 'horizontal':
+        # Every row is the same run of column colors
+        row = b''.join(_blend_rgb(start_rgb, end_rgb, x / width) for x in range(width))
+        data = row * rows
+    elif direction == 'diagonal':
+        # Color depends on x + y, so each row is a window into one run of colors
+        colors = b''.join(
+            _blend_rgb(start_rgb, end_rgb, i / (width + height))
+            for i in range(top, bottom + width - 1)
+        )
+        data = b''.join(colors[3 * y:3 * (y + width)] for y in range(rows))
+    else:  # vertical
+        data = b''.join(_blend_rgb(start_rgb, end_rgb, y / height) * width for y in range(top, bottom))
+    
+    return Image.frombytes('RGB', (width, rows), data)
+
+
+def composite_background(background, img):
+    """Paste img onto an RGB background of the same size"""
+    # If original image has transparency, paste it onto the background
+    if img.mode == 'RGBA':
+        background.paste(img, (0, 0), img)
+        return background.convert('RGBA')
+    else:
+        # For non-transparent images, just return the original with background color applied
+        background.paste(img, (0, 0))
+        return background
+
+
+def adjust_opacity(img, opacity):
+    """Scale image transparency by opacity (0.0-1.0)"""
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    
+    canvas = _shared_canvas(img)
+    if canvas:
+        canvas.run('opacity', opacity)
+        return img
+    return apply_opacity(img, opacity)
+
+
+def adjust_saturation(img, saturation):
+    """Adjust color intensity, 1.0 leaves the image unchanged"""
+    canvas = _shared_canvas(img)
+    if canvas:
+        canvas.run('saturation', saturation)
+        return img
+    return apply_saturation(img, saturation)
+
+
+def optimized_wallpaper_dimensions(width, height):
+    """Return the optimized (width, height) for wallpaper use, or None if already optimized"""
     # Calculate aspect ratio
     aspect_ratio = width / height
     
@@ -21,14 +122,14 @@ def optimize_wallpaper_size(img):
             new_width = 2560
             new_height = int(new_width / aspect_ratio)
         else:
-            return img  # Already optimized
+            return None  # Already optimized
     elif aspect_ratio < 0.8:  # Portrait (mobile)
         # Optimize for mobile use
         if height > 2560:
             new_height = 2560
             new_width = int(new_height * aspect_ratio)
         else:
-            return img  # Already optimized
+            return None  # Already optimized
     else:  # Square-ish
         # Optimize for general use
         max_dim = max(width, height)
@@ -37,9 +138,18 @@ def optimize_wallpaper_size(img):
             new_width = int(width * scale_factor)
             new_height = int(height * scale_factor)
         else:
-            return img  # Already optimized
+            return None  # Already optimized
     
-    return img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    return new_width, new_height
+
+
+def optimize_wallpaper_size(img):
+    """Optimize image size for common wallpaper use while maintaining quality"""
+    new_size = optimized_wallpaper_dimensions(*img.size)
+    if new_size is None:
+        return img  # Already optimized
+    
+    return img.resize(new_size, Image.Resampling.LANCZOS)
 
 
 def resize_for_wallpaper(img, target_size, fit_mode='fit'):
@@ -227,76 +337,14 @@ def add_background(img, background_config):
     """Add background to image"""
     bg_type = background_config.get('type', 'color')
     
-    if bg_type == 'color':
-        color = background_config.get('color', '#FFFFFF')
-        # Convert hex to RGB
-        if color.startswith('#'):
-            color = color[1:]
-        rgb_color = tuple(int(color[i:i+2], 16) for i in (0, 2, 4))
-        
-        # Create background with same size as image
-        background = Image.new('RGB', img.size, rgb_color)
-        
-        # If original image has transparency, paste it onto the background
-        if img.mode == 'RGBA':
-            background.paste(img, (0, 0), img)
-            return background.convert('RGBA')
-        else:
-            # For non-transparent images, just return the original with background color applied
-            background.paste(img, (0, 0))
-            return background
-            
-    elif bg_type == 'gradient':
-        # Create a gradient background
-        start_color = background_config.get('start_color', '#FFFFFF')
-        end_color = background_config.get('end_color', '#000000')
-        direction = background_config.get('direction', 'vertical')  # vertical, horizontal, diagonal
-        
-        # Convert hex to RGB
-        def hex_to_rgb(hex_color):
-            if hex_color.startswith('#'):
-                hex_color = hex_color[1:]
-            return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-        
-        start_rgb = hex_to_rgb(start_color)
-        end_rgb = hex_to_rgb(end_color)
-        
-        # Create gradient
-        width, height = img.size
-        background = Image.new('RGB', (width, height))
-        
-        if direction == 'horizontal':
-            for x in range(width):
-                ratio = x / width
-                r = int(start_rgb[0] * (1 - ratio) + end_rgb[0] * ratio)
-                g = int(start_rgb[1] * (1 - ratio) + end_rgb[1] * ratio)
-                b = int(start_rgb[2] * (1 - ratio) + end_rgb[2] * ratio)
-                for y in range(height):
-                    background.putpixel((x, y), (r, g, b))
-        elif direction == 'diagonal':
-            for x in range(width):
-                for y in range(height):
-                    ratio = (x + y) / (width + height)
-                    r = int(start_rgb[0] * (1 - ratio) + end_rgb[0] * ratio)
-                    g = int(start_rgb[1] * (1 - ratio) + end_rgb[1] * ratio)
-                    b = int(start_rgb[2] * (1 - ratio) + end_rgb[2] * ratio)
-                    background.putpixel((x, y), (r, g, b))
-        else:  # vertical
-            for y in range(height):
-                ratio = y / height
-                r = int(start_rgb[0] * (1 - ratio) + end_rgb[0] * ratio)
-                g = int(start_rgb[1] * (1 - ratio) + end_rgb[1] * ratio)
-                b = int(start_rgb[2] * (1 - ratio) + end_rgb[2] * ratio)
-                for x in range(width):
-                    background.putpixel((x, y), (r, g, b))
+    if bg_type in ('color', 'gradient'):
+        canvas = _shared_canvas(img)
+        if canvas:
+            canvas.run('fill_background', background_config)
+            return img
         
-        # Paste image onto gradient background
-        if img.mode == 'RGBA':
-            background.paste(img, (0, 0), img)
-            return background.convert('RGBA')
-        else:
-            background.paste(img, (0, 0))
-            return background
+        background = render_background(img.size, background_config)
+        return composite_background(background, img)
             
     elif bg_type == 'pattern':
         # Create pattern background
@@ -304,17 +352,16 @@ def add_background(img, background_config):
         color1 = background_config.get('color1', '#FFFFFF')
         color2 = background_config.get('color2', '#E0E0E0')
         
-        # Convert hex to RGB
-        def hex_to_rgb(hex_color):
-            if hex_color.startswith('#'):
-                hex_color = hex_color[1:]
-            return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-        
         rgb1 = hex_to_rgb(color1)
         rgb2 = hex_to_rgb(color2)
         
         width, height = img.size
-        background = Image.new('RGB', (width, height), rgb1)
+        # On a shared canvas the pattern is drawn straight into shared memory
+        canvas = _shared_canvas(img)
+        background = canvas.scratch('RGBX', rgb1 + (255,)) if canvas else None
+        if background is None:
+            canvas = None
+            background = Image.new('RGB', (width, height), rgb1)
         draw = ImageDraw.Draw(background)
         
         if pattern_type == 'dots':
@@ -426,12 +473,10 @@ def add_background(img, background_config):
             # ], fill=rgb2)
         
         # Paste image onto pattern background
-        if img.mode == 'RGBA':
-            background.paste(img, (0, 0), img)
-            return background.convert('RGBA')
-        else:
-            background.paste(img, (0, 0))
-            return background
+        if canvas:
+            canvas.run('composite_background', scratch=background)
+            return img
+        return composite_background(background, img)
     
     return img
 
@@ -449,7 +494,11 @@ def add_watermark(img, watermark_config):
         opacity = watermark_config.get('opacity', 50)
         
         # Create watermark layer
-        watermark_layer = Image.new('RGBA', img.size, (0, 0, 0, 0))
+        canvas = _shared_canvas(img)
+        watermark_layer = canvas.scratch('RGBA', (0, 0, 0, 0)) if canvas else None
+        if watermark_layer is None:
+            canvas = None
+            watermark_layer = Image.new('RGBA', img.size, (0, 0, 0, 0))
         draw = ImageDraw.Draw(watermark_layer)
         
         try:
@@ -486,6 +535,9 @@ def add_watermark(img, watermark_config):
         draw.text((x, y), text, fill=color_with_alpha, font=font)
         
         # Composite watermark
-        img = Image.alpha_composite(img, watermark_layer)
+        if canvas:
+            canvas.run('alpha_composite', scratch=watermark_layer)
+        else:
+            img = Image.alpha_composite(img, watermark_layer)
     
     return img
\ No newline at end of file
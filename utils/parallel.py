@@ -0,0 +1,343 @@
+"""
+Multi-core rendering for large images in EWOK
+A SharedCanvas holds a request's RGBA canvas in shared memory for as long as
+its size stays the same. Row-local stages (opacity, saturation, background
+fill and compositing) run on it in place, one horizontal strip per pool
+process, and serial stages such as text and image overlays draw straight
+onto the same buffer, so pixels are copied in once and out once per canvas.
+
+Text and image overlays, pattern drawing and watermark text rendering stay
+serial on the full canvas, so shapes that straddle strip boundaries are
+drawn exactly as before; only the per-pixel work after them is split.
+Resizing changes the canvas size and is not split either.
+"""
+
+import errno
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+from PIL import Image
+
+from utils.image_processing import (
+    apply_opacity, apply_saturation,
+    render_background, composite_background
+)
+
+# Defaults, overridden by configure() from config.py
+ENABLED = True
+PIXEL_THRESHOLD = 8_000_000
+WORKERS = min(4, os.cpu_count() or 1)
+MIN_STRIP_ROWS = 64
+
+# POSIX shared memory lives in this tmpfs; Docker limits it to 64MB by default
+SHM_PATH = '/dev/shm'
+SHM_HEADROOM = 16 * 1024 * 1024
+
+# Rough single-core seconds per megapixel of copying a canvas into shared
+# memory and back out, and of dispatching one stage to the pool and writing
+# its strips back. See the strips/ cases in benchmarks/bench_image_processing.py.
+# A canvas is only shared when the time its stages save outweighs these.
+HANDOFF_COST = 0.005
+STRIP_OVERHEAD = 0.002
+
+_pool = None
+_pool_lock = threading.Lock()
+_forked = False
+_canvases = {}
+
+
+def configure(enabled=None, pixel_threshold=None, workers=None):
+    """Update the parallel rendering settings"""
+    global ENABLED, PIXEL_THRESHOLD, WORKERS
+    if enabled is not None:
+        ENABLED = enabled
+    if pixel_threshold is not None:
+        PIXEL_THRESHOLD = pixel_threshold
+    if workers is not None:
+        WORKERS = workers
+        shutdown()
+
+
+def should_parallelize(size):
+    """Whether an image of this size may be rendered in strips"""
+    width, height = size
+    return (ENABLED and WORKERS > 1 and width * height >= PIXEL_THRESHOLD
+            and height >= 2 * MIN_STRIP_ROWS)
+
+
+def worth_sharing(size, stage_costs):
+    """Whether running row-local stages in strips saves more than the canvas copies cost
+
+    stage_costs maps each stage to its single-core seconds per megapixel, as
+    calibrated by the cost model.
+    """
+    if not should_parallelize(size):
+        return False
+    serial = sum(stage_costs.values())
+    overhead = HANDOFF_COST + STRIP_OVERHEAD * len(stage_costs)
+    return serial * (1 - 1 / WORKERS) > overhead
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Forking a threaded server is unsafe, start workers from a clean
+            # process. A forked child inherits its parent's fork server, so it
+            # spawns instead.
+            methods = multiprocessing.get_all_start_methods()
+            use_forkserver = 'forkserver' in methods and not _forked
+            context = multiprocessing.get_context('forkserver' if use_forkserver else 'spawn')
+            _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=context)
+        return _pool
+
+
+def shutdown(wait=False):
+    """Stop the worker pool; it is started again on next use"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait, cancel_futures=True)
+            _pool = None
+
+
+def _reset_after_fork():
+    """Drop the parent's pool in a forked child
+
+    The executor's manager thread and pipes don't survive fork, so submitting
+    to the inherited pool would block forever. The child starts its own pool
+    on next use; the lock may have been held by another thread mid-fork.
+    """
+    global _pool, _pool_lock, _forked
+    _pool = None
+    _forked = True
+    _pool_lock = threading.Lock()
+    _canvases.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _strips(height):
+    """Split rows into one strip per worker, at least MIN_STRIP_ROWS tall"""
+    count = max(1, min(WORKERS, height // MIN_STRIP_ROWS))
+    bounds = [height * i // count for i in range(count + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+def _allocate(nbytes):
+    """Create a shared memory block; raises OSError when none is available
+
+    Writing to a tmpfs page that can't be backed raises SIGBUS rather than an
+    error, so check the free space first and reserve the pages up front.
+    """
+    if os.path.isdir(SHM_PATH):
+        stats = os.statvfs(SHM_PATH)
+        available = stats.f_bavail * stats.f_frsize
+        if available < nbytes + SHM_HEADROOM:
+            raise OSError(errno.ENOSPC, f'{SHM_PATH} has {available / 1e6:.0f}MB free, '
+                                        f'{nbytes / 1e6:.0f}MB needed')
+
+    block = shared_memory.SharedMemory(create=True, size=nbytes)
+    fd = getattr(block, '_fd', -1)
+    if fd >= 0 and hasattr(os, 'posix_fallocate'):
+        try:
+            # Another process may have taken the space since the check above
+            os.posix_fallocate(fd, 0, nbytes)
+        except OSError:
+            block.close()
+            block.unlink()
+            raise
+    return block
+
+
+def _close_block(block):
+    """Close a shared memory block, even while an image still uses its buffer
+
+    The mapping then stays until that image is freed, but the file is closed
+    right away; an unlinked tmpfs file keeps its pages for as long as it is open.
+    """
+    try:
+        block.close()
+    except BufferError:
+        # The image's buffer export keeps the mapping alive on its own
+        block._buf = block._mmap = None
+        fd = getattr(block, '_fd', -1)
+        if fd >= 0:
+            os.close(fd)
+            block._fd = -1
+
+
+def _view(block, mode, size):
+    """Writable image over a shared memory block ('RGBA' or 'RGBX', 4 bytes per pixel)"""
+    img = Image.frombuffer(mode, size, block.buf, 'raw', mode, 0, 1)
+    # frombuffer images are read-only, writes here are meant to reach the block
+    img.readonly = 0
+    return img
+
+
+def _render_strip(op, views, size, top, bottom, params):
+    """Render one stage over rows top..bottom of the canvas in place"""
+    width, _ = size
+    rows = bottom - top
+    strip = Image.frombuffer('RGBA', (width, rows), views[0], 'raw', 'RGBA', 0, 1)
+    strip.readonly = 0
+    if op == 'opacity':
+        result = apply_opacity(strip, params)
+    elif op == 'saturation':
+        result = apply_saturation(strip, params)
+    elif op == 'fill_background':
+        background = render_background(size, params, top, bottom)
+        result = composite_background(background, strip)
+    elif op == 'composite_background':
+        background = Image.frombuffer('RGBX', (width, rows), views[1], 'raw', 'RGBX', 0, 1)
+        result = composite_background(background.convert('RGB'), strip)
+    elif op == 'alpha_composite':
+        layer = Image.frombuffer('RGBA', (width, rows), views[1], 'raw', 'RGBA', 0, 1)
+        result = Image.alpha_composite(strip, layer)
+    else:
+        raise ValueError(f'Unknown strip operation: {op}')
+    if result is not strip:
+        # Written back in one copy once the whole strip is rendered
+        strip.paste(result)
+
+
+def _process_strip(op, names, size, top, bottom, params):
+    """Worker: run one stage on rows top..bottom of the shared canvas in place"""
+    row_bytes = size[0] * 4
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    views = []
+    try:
+        views = [block.buf[top * row_bytes:bottom * row_bytes] for block in blocks]
+        _render_strip(op, views, size, top, bottom, params)
+    finally:
+        for view in views:
+            try:
+                view.release()
+            except BufferError:
+                # An exception left a strip image holding the buffer; the
+                # mapping is freed with it, don't mask the original error
+                pass
+        for block in blocks:
+            _close_block(block)
+
+
+class SharedCanvas:
+    """An RGBA image held in shared memory for strip rendering
+
+    `image` is a writable image over the shared buffer: serial stages draw on
+    it in place and run() applies row-local stages to it in the pool. Copy the
+    result out with export(), then close() the canvas.
+    """
+
+    def __init__(self, img):
+        self.size = img.size
+        self._block = _allocate(img.width * img.height * 4)
+        self._scratch_block = None
+        self._scratch = None
+        try:
+            self.image = _view(self._block, 'RGBA', self.size)
+            self.image.paste(img)
+        except Exception:
+            self.image = None
+            self.close()
+            raise
+        _canvases[id(self.image)] = self
+
+    def scratch(self, mode, color):
+        """Return a canvas-sized 'RGBA' or 'RGBX' image in shared memory filled
+        with color, or None when no shared memory is available
+
+        The block is reused by later calls, so only one scratch image is live.
+        """
+        fresh = self._scratch_block is None
+        if fresh:
+            try:
+                self._scratch_block = _allocate(self.size[0] * self.size[1] * 4)
+            except OSError as e:
+                print(f"Parallel rendering unavailable, rendering serially: {e}")
+                return None
+        self._scratch = _view(self._scratch_block, mode, self.size)
+        # New blocks are zero-filled, already transparent black
+        if not fresh or any(color):
+            self._scratch.paste(color, (0, 0) + self.size)
+        return self._scratch
+
+    def run(self, op, params=None, scratch=None):
+        """Apply a row-local stage to the canvas in place, one strip per worker"""
+        names = [self._block.name]
+        if scratch is not None:
+            names.append(self._scratch_block.name)
+        strips = _strips(self.size[1])
+
+        futures = []
+        # Only the message is kept; a traceback through this frame would keep
+        # the scratch image, and so its shared memory, alive
+        reason = None
+        try:
+            pool = _get_pool()
+            for top, bottom in strips:
+                futures.append(pool.submit(_process_strip, op, names, self.size, top, bottom, params))
+        except (BrokenProcessPool, RuntimeError, OSError) as e:
+            reason = str(e)
+
+        unfinished = strips[len(futures):]
+        for strip, future in zip(strips, futures):
+            try:
+                future.result()
+            except BrokenProcessPool as e:
+                # A worker died. Strips are written back in one copy at the
+                # end, so a strip that never got there still holds its input
+                reason = str(e)
+                # Every future of the broken pool holds this same exception
+                e.__traceback__ = None
+                unfinished.append(strip)
+
+        if unfinished:
+            print(f"Parallel rendering failed, finishing serially: {reason}")
+            shutdown()
+            for top, bottom in unfinished:
+                _process_strip(op, names, self.size, top, bottom, params)
+
+    def export(self, img):
+        """Return img as a standalone image; close() the canvas once the
+        caller has dropped its references to the canvas image"""
+        if img is self.image:
+            return img.copy()
+        return img
+
+    def close(self):
+        """Free the shared memory; the canvas image must not be used afterwards"""
+        if self.image is not None and _canvases.get(id(self.image)) is self:
+            del _canvases[id(self.image)]
+        self.image = None
+        self._scratch = None
+        for block in (self._block, self._scratch_block):
+            if block is None:
+                continue
+            _close_block(block)
+            block.unlink()
+        self._block = self._scratch_block = None
+
+
+def share(img):
+    """Copy an RGBA image into a new SharedCanvas, or return None when no
+    shared memory is available"""
+    try:
+        return SharedCanvas(img)
+    except OSError as e:
+        print(f"Parallel rendering unavailable, rendering serially: {e}")
+        return None
+
+
+def canvas_of(img):
+    """Return the SharedCanvas whose image is img, or None"""
+    canvas = _canvases.get(id(img))
+    if canvas is not None and canvas.image is img:
+        return canvas
+    return None
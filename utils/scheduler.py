@@ -0,0 +1,264 @@
+"""
+Admission control for EWOK image processing
+Admits requests against a memory and CPU budget in shortest-job-first order
+and enforces per-user quotas using predictions from the cost model. The
+budgets, queue and quotas can be shared by all worker processes of a server
+through a locked state file.
+"""
+
+import contextlib
+import itertools
+import json
+import math
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Seconds between checks for budget freed by other processes
+POLL_INTERVAL = 0.05
+
+# Ticket ids are "<pid>-<n>", unique across the processes sharing a state file
+_ticket_ids = itertools.count()
+
+
+class AdmissionError(Exception):
+    """A request that cannot be admitted; carries the HTTP status to return"""
+
+    status_code = 503
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class QuotaExceeded(AdmissionError):
+    """The user is over their per-user quota"""
+
+    status_code = 429
+
+
+class Overloaded(AdmissionError):
+    """The server cannot fit the request in its budget right now"""
+
+    status_code = 503
+
+
+class _Ticket:
+    """A request waiting for, or holding, part of the budget"""
+
+    def __init__(self, ticket_id, user, estimate):
+        self.id = ticket_id
+        self.user = user
+        self.cpu_seconds = estimate.cpu_seconds
+        self.memory_bytes = estimate.memory_bytes
+
+
+def _new_state():
+    # tickets: {id: ticket fields}, usage: {user: [[timestamp, cpu_seconds, id]]}
+    return {'sequence': 0, 'tickets': {}, 'usage': {}}
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class AdmissionScheduler:
+    """Shortest-job-first admission against memory and CPU budgets
+
+    The CPU budget is the total predicted CPU seconds allowed in flight at
+    once, the memory budget the total predicted peak bytes. Waiting requests
+    are admitted cheapest first; a request is always admitted when nothing
+    else is running so a single large job can still make progress.
+
+    With a state_path, the budgets, queue and quotas live in that file and
+    apply across every process using it, such as the workers of a gunicorn
+    server. Tickets of processes that died are dropped. Without one, or where
+    file locking is unavailable, they apply to this process only.
+    """
+
+    def __init__(self, memory_budget, cpu_budget, max_wait=30.0,
+                 user_max_pending=4, user_cpu_quota=60.0, quota_window=60.0,
+                 state_path=None):
+        self.memory_budget = memory_budget
+        self.cpu_budget = cpu_budget
+        self.max_wait = max_wait
+        self.user_max_pending = user_max_pending
+        self.user_cpu_quota = user_cpu_quota
+        self.quota_window = quota_window
+        self.state_path = state_path if fcntl is not None else None
+
+        self._condition = threading.Condition()
+        self._state = _new_state()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Hold the scheduler state, locked against other threads and processes"""
+        with self._condition:
+            if self.state_path is None:
+                self._expire(self._state)
+                yield self._state
+                return
+
+            with open(self.state_path, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                try:
+                    state = json.loads(f.read())
+                except ValueError:
+                    # New, or cut short by a process that died mid-write
+                    state = _new_state()
+                self._expire(state)
+                try:
+                    yield state
+                finally:
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(state, f)
+
+    def _expire(self, state):
+        """Drop tickets of dead processes and usage older than the quota window"""
+        pids = {ticket['pid'] for ticket in state['tickets'].values()}
+        dead = {pid for pid in pids if pid != os.getpid() and not _pid_alive(pid)}
+        if dead:
+            state['tickets'] = {ticket_id: ticket for ticket_id, ticket in state['tickets'].items()
+                                if ticket['pid'] not in dead}
+
+        cutoff = time.time() - self.quota_window
+        for user in list(state['usage']):
+            usage = [entry for entry in state['usage'][user] if entry[0] > cutoff]
+            if usage:
+                state['usage'][user] = usage
+            else:
+                del state['usage'][user]
+
+    def _check_quota(self, state, user, estimate, now):
+        pending = sum(1 for ticket in state['tickets'].values() if ticket['user'] == user)
+        if self.user_max_pending and pending >= self.user_max_pending:
+            raise QuotaExceeded(
+                f'Too many requests in progress (limit {self.user_max_pending})', retry_after=1)
+
+        if not self.user_cpu_quota:
+            return
+        if estimate.cpu_seconds > self.user_cpu_quota:
+            raise QuotaExceeded(
+                f'Request is too expensive: estimated {estimate.cpu_seconds:.1f}s of processing '
+                f'exceeds the {self.user_cpu_quota:.0f}s per {self.quota_window:.0f}s quota')
+
+        usage = state['usage'].get(user, [])
+        used = sum(cost for _, cost, _ in usage)
+        if used + estimate.cpu_seconds > self.user_cpu_quota:
+            # Wait until enough earlier requests leave the window
+            excess = used + estimate.cpu_seconds - self.user_cpu_quota
+            retry_after = self.quota_window
+            for timestamp, cost, _ in usage:
+                excess -= cost
+                if excess <= 0:
+                    retry_after = timestamp + self.quota_window - now
+                    break
+            raise QuotaExceeded(
+                f'Processing quota exceeded: {used:.1f}s of {self.user_cpu_quota:.0f}s '
+                f'used in the last {self.quota_window:.0f}s',
+                retry_after=max(1, math.ceil(retry_after)))
+
+    def _dispatch(self, state):
+        """Admit waiting tickets cheapest first while they fit"""
+        tickets = state['tickets'].values()
+        running = [ticket for ticket in tickets if ticket['admitted']]
+        in_flight = len(running)
+        memory_in_use = sum(ticket['memory_bytes'] for ticket in running)
+        cpu_in_use = sum(ticket['cpu_seconds'] for ticket in running)
+
+        waiting = sorted((ticket for ticket in tickets if not ticket['admitted']),
+                         key=lambda ticket: (ticket['cpu_seconds'], ticket['sequence']))
+        admitted = False
+        for ticket in waiting:
+            fits = in_flight == 0 or (
+                memory_in_use + ticket['memory_bytes'] <= self.memory_budget
+                and cpu_in_use + ticket['cpu_seconds'] <= self.cpu_budget)
+            if not fits:
+                break
+            ticket['admitted'] = True
+            in_flight += 1
+            memory_in_use += ticket['memory_bytes']
+            cpu_in_use += ticket['cpu_seconds']
+            admitted = True
+        if admitted:
+            self._condition.notify_all()
+
+    def _retry_after(self, state):
+        # Rough time for the work ahead of us to drain
+        return max(1, math.ceil(sum(ticket['cpu_seconds'] for ticket in state['tickets'].values())))
+
+    def _enqueue(self, state, ticket):
+        state['sequence'] += 1
+        state['tickets'][ticket.id] = {
+            'user': ticket.user,
+            'cpu_seconds': ticket.cpu_seconds,
+            'memory_bytes': ticket.memory_bytes,
+            'sequence': state['sequence'],
+            'admitted': False,
+            'pid': os.getpid(),
+        }
+
+    def acquire(self, user, estimate):
+        """Block until the request is admitted; raises AdmissionError otherwise"""
+        with self._condition:
+            with self._locked() as state:
+                now = time.time()
+                self._check_quota(state, user, estimate, now)
+                if estimate.memory_bytes > self.memory_budget:
+                    raise Overloaded(
+                        f'Request needs an estimated {estimate.memory_bytes / 1e6:.0f}MB, more than '
+                        f'the {self.memory_budget / 1e6:.0f}MB processing budget')
+
+                ticket = _Ticket(f'{os.getpid()}-{next(_ticket_ids)}', user, estimate)
+                self._enqueue(state, ticket)
+                state['usage'].setdefault(user, []).append([now, estimate.cpu_seconds, ticket.id])
+
+            deadline = time.monotonic() + self.max_wait
+            while True:
+                with self._locked() as state:
+                    if ticket.id not in state['tickets']:
+                        # The state file was lost, queue again
+                        self._enqueue(state, ticket)
+                    # Budget may also have been freed by other processes
+                    self._dispatch(state)
+                    if state['tickets'][ticket.id]['admitted']:
+                        return ticket
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._abandon(state, ticket)
+                        raise Overloaded('Server is busy, please try again shortly',
+                                         retry_after=self._retry_after(state))
+                if self.state_path is not None:
+                    remaining = min(remaining, POLL_INTERVAL)
+                self._condition.wait(remaining)
+
+    def _abandon(self, state, ticket):
+        state['tickets'].pop(ticket.id, None)
+        # Give the unused quota back
+        usage = state['usage'].get(ticket.user)
+        if usage:
+            usage[:] = [entry for entry in usage if entry[2] != ticket.id]
+            if not usage:
+                del state['usage'][ticket.user]
+        # Requests queued behind this one may fit now
+        self._dispatch(state)
+
+    def release(self, ticket):
+        """Return an admitted request's budget and wake waiting requests"""
+        with self._locked() as state:
+            state['tickets'].pop(ticket.id, None)
+            self._dispatch(state)
@@ -2,23 +2,90 @@ from flask import Blueprint, request, jsonify, send_file
 import os
 import uuid
 import sys
+import time
 from werkzeug.utils import secure_filename
-from PIL import Image, ImageEnhance
+from PIL import Image
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+import config
 from config import UPLOAD_FOLDER, TEMP_FOLDER, ALLOWED_EXTENSIONS, WALLPAPER_PRESETS
 from utils.image_processing import (
     resize_for_wallpaper, optimize_wallpaper_size, 
     add_text_overlays, add_image_overlays, 
-    add_background, add_watermark
+    add_background, add_watermark,
+    adjust_opacity, adjust_saturation
 )
+from utils import parallel
+from utils.cost_model import CostModel, background_stage, row_stages, text_units, watermark_applies
+from utils.scheduler import AdmissionScheduler, AdmissionError
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+cost_model = CostModel(smoothing=config.COST_MODEL_SMOOTHING)
+scheduler = AdmissionScheduler(
+    memory_budget=config.SCHEDULER_MEMORY_BUDGET,
+    cpu_budget=config.SCHEDULER_CPU_BUDGET,
+    max_wait=config.SCHEDULER_MAX_WAIT,
+    user_max_pending=config.USER_MAX_PENDING,
+    user_cpu_quota=config.USER_CPU_QUOTA,
+    quota_window=config.USER_QUOTA_WINDOW,
+    state_path=config.SCHEDULER_STATE_FILE,
+) if config.SCHEDULER_ENABLED else None
+
+parallel.configure(
+    enabled=config.PARALLEL_ENABLED,
+    pixel_threshold=config.PARALLEL_PIXEL_THRESHOLD,
+    workers=config.PARALLEL_WORKERS,
+)
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def request_user():
+    """Identify the user of the current request for the per-user quotas"""
+    if config.USER_ID_HEADER:
+        user = request.headers.get(config.USER_ID_HEADER)
+        if user:
+            return user
+    return request.remote_addr or 'anonymous'
+
+def megapixels(img):
+    """Image size in megapixels, the cost model's unit for pixel stages"""
+    return img.width * img.height / 1e6
+
+def record_stage(stage, units, start, img=None):
+    """Feed a stage's measured CPU time back into the cost model, return the next stage start"""
+    now = time.thread_time()
+    # Strip-rendered stages spend their CPU time in the pool, not this thread
+    if img is None or parallel.canvas_of(img) is None:
+        cost_model.observe(stage, units, now - start)
+    return now
+
+def share_canvas(img, stages):
+    """Move img into shared memory when its row-local stages are worth splitting across cores"""
+    if not parallel.worth_sharing(img.size, cost_model.costs(stages)):
+        return None, img
+    canvas = parallel.share(img)
+    if canvas is None:
+        return None, img
+    return canvas, canvas.image
+
+def admission_error_response(error, estimate):
+    """Build a 429/503 response for a request that was not admitted"""
+    response = jsonify({
+        'error': error.message,
+        'retry_after': error.retry_after,
+        'estimate': {
+            'cpu_seconds': round(estimate.cpu_seconds, 3),
+            'memory_mb': round(estimate.memory_bytes / 1e6, 1),
+            'output_size': estimate.output_size,
+        },
+    })
+    if error.retry_after:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response, error.status_code
+
 @api_bp.route('/upload', methods=['POST'])
 def upload_file():
     """Handle file uploads"""
@@ -60,68 +127,111 @@ def process_image():
         return jsonify({'error': 'File not found'}), 404
     
     try:
+        # Only reads the header, the pixels are decoded below once admitted
+        with Image.open(input_path) as probe_img:
+            estimate = cost_model.estimate(data, probe_img.size, WALLPAPER_PRESETS)
+    except Exception as e:
+        return jsonify({'error': f'Processing failed: {str(e)}'}), 500
+    
+    ticket = None
+    if scheduler is not None:
+        try:
+            ticket = scheduler.acquire(request_user(), estimate)
+        except AdmissionError as e:
+            return admission_error_response(e, estimate)
+    
+    canvas = None
+    try:
+        stage_start = time.thread_time()
         with Image.open(input_path) as base_img:
             # Convert to RGBA for transparency support
             if base_img.mode != 'RGBA':
                 base_img = base_img.convert('RGBA')
             
             result_img = base_img.copy()
+            stage_start = record_stage('decode', megapixels(result_img), stage_start)
+            
+            # Keep the canvas in shared memory until its size changes
+            before, after, resizes = row_stages(estimate.stages)
+            canvas, result_img = share_canvas(result_img, before if resizes else before + after)
             
             # Apply opacity (transparency)
             if 'opacity' in data and data['opacity'] != 100:
-                opacity = data['opacity'] / 100.0
-                if result_img.mode != 'RGBA':
-                    result_img = result_img.convert('RGBA')
-                
-                # Create new alpha channel based on opacity
-                alpha = result_img.split()[-1]  # Get current alpha channel
-                alpha = alpha.point(lambda p: int(p * opacity))  # Scale alpha values
-                result_img.putalpha(alpha)
+                result_img = adjust_opacity(result_img, data['opacity'] / 100.0)
+                stage_start = record_stage('opacity', megapixels(result_img), stage_start, result_img)
             
             # Apply saturation (color intensity)
             if 'saturation' in data and data['saturation'] != 100:
-                saturation = data['saturation'] / 100.0
-                enhancer = ImageEnhance.Color(result_img)
-                result_img = enhancer.enhance(saturation)
+                result_img = adjust_saturation(result_img, data['saturation'] / 100.0)
+                stage_start = record_stage('saturation', megapixels(result_img), stage_start, result_img)
             
             # Apply custom resize
             if 'resize' in data and data['resize'] != 100:
                 resize_factor = data['resize'] / 100.0
                 new_width = int(result_img.width * resize_factor)
                 new_height = int(result_img.height * resize_factor)
+                source_mp = megapixels(result_img)
                 result_img = result_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+                stage_start = record_stage('resize', source_mp + megapixels(result_img), stage_start)
             
             # Resize for wallpaper mode
             if data.get('wallpaper_mode') and data.get('wallpaper_preset'):
                 preset_name = data['wallpaper_preset']
                 if preset_name in WALLPAPER_PRESETS:
+                    source_size = result_img.size
+                    source_mp = megapixels(result_img)
                     if preset_name == 'Optimized':
                         # For optimized mode, calculate best size based on original dimensions
                         result_img = optimize_wallpaper_size(result_img)
+                        resized = result_img.size != source_size
                     else:
                         target_size = WALLPAPER_PRESETS[preset_name]
                         result_img = resize_for_wallpaper(result_img, target_size, data.get('fit_mode', 'fit'))
+                        resized = True
+                    if resized:
+                        stage_start = record_stage('wallpaper', source_mp + megapixels(result_img), stage_start)
+            
+            if canvas is not None and result_img is not canvas.image:
+                # Resizing copied the pixels out of shared memory
+                canvas.close()
+                canvas = None
+            if canvas is None:
+                canvas, result_img = share_canvas(result_img, after)
             
             # Add text overlays
             if 'text_overlays' in data:
                 result_img = add_text_overlays(result_img, data['text_overlays'])
+                stage_start = record_stage('text', text_units(data['text_overlays']), stage_start)
             
             # Add image overlays
             if 'image_overlays' in data:
                 result_img = add_image_overlays(result_img, data['image_overlays'], UPLOAD_FOLDER)
+                stage_start = record_stage('image_overlays', len(data['image_overlays']), stage_start)
             
             # Add background
             if 'background' in data and data['background']:
                 result_img = add_background(result_img, data['background'])
+                stage = background_stage(data['background'])
+                if stage:
+                    stage_start = record_stage(stage, megapixels(result_img), stage_start, result_img)
             
             # Add watermark
             if 'watermark' in data:
                 result_img = add_watermark(result_img, data['watermark'])
+                if watermark_applies(data['watermark']):
+                    stage_start = record_stage('watermark', megapixels(result_img), stage_start, result_img)
+            
+            if canvas is not None:
+                result_img = canvas.export(result_img)
+                canvas.close()
+                canvas = None
             
             # Save processed image
             output_filename = f"processed_{uuid.uuid4()}.png"
             output_path = os.path.join(TEMP_FOLDER, output_filename)
+            stage_start = time.thread_time()
             result_img.save(output_path, 'PNG')
+            record_stage('encode', megapixels(result_img), stage_start)
             
             return jsonify({
                 'success': True,
@@ -131,6 +241,13 @@ def process_image():
             
     except Exception as e:
         return jsonify({'error': f'Processing failed: {str(e)}'}), 500
+    finally:
+        if canvas is not None:
+            # The canvas image must be unreferenced before its memory is freed
+            result_img = None
+            canvas.close()
+        if ticket is not None:
+            scheduler.release(ticket)
 
 @api_bp.route('/download/<filename>')
 def download_file(filename):